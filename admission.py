@@ -0,0 +1,235 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from starlette.responses import JSONResponse
+
+import config
+
+ADMISSION_PREFIXES = ('/film', '/planet')
+READ_METHODS = ('GET', 'HEAD')
+# Requisições com credenciais podem ter respostas diferentes para cada cliente
+CREDENTIAL_HEADERS = (b'cookie', b'authorization')
+
+
+# Limita as requisições simultâneas de um grupo de rotas. Quem passa do limite
+# espera numa fila curta; com a fila cheia ou após o timeout a requisição é descartada.
+# Todo o estado é usado apenas no event loop, então não precisa de lock.
+class Bulkhead:
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        if self.active < self.limit:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if self.queued >= self.queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if not self._handed_over(waiter):
+                self.shed += 1
+                return False
+        except asyncio.CancelledError:
+            # Cliente desconectou: se a vaga já tinha sido entregue, repassa adiante
+            if self._handed_over(waiter):
+                self.release()
+            raise
+        finally:
+            self.queued -= 1
+
+        self.admitted += 1
+        return True
+
+    @staticmethod
+    def _handed_over(waiter):
+        return waiter.done() and not waiter.cancelled()
+
+    def release(self):
+        # A vaga passa direto para o próximo da fila que ainda está esperando
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def metrics(self):
+        return dict(
+            limit=self.limit,
+            queue_size=self.queue_size,
+            active=self.active,
+            queued=self.queued,
+            admitted=self.admitted,
+            shed=self.shed,
+        )
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets = OrderedDict()
+
+    # Retorna 0 quando a requisição pode seguir, ou quantos segundos esperar
+    def acquire(self, client):
+        if self.rate <= 0:
+            return 0
+
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+
+        # Clientes inativos há mais tempo são descartados primeiro
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+        return wait
+
+    def metrics(self):
+        return dict(rate=self.rate, burst=self.burst, clients=len(self._buckets), limited=self.limited)
+
+
+# Requisições idênticas que chegam enquanto outra está em andamento esperam
+# por ela e recebem uma cópia da mesma resposta
+class SingleFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._flights = dict()
+
+    async def run(self, key, call, send):
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            messages = await asyncio.shield(flight)
+            if messages is None:
+                # A requisição original falhou, então esta segue sozinha
+                await call(send)
+                return
+            for message in messages:
+                await send(self._copy(message))
+            return
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        messages = list()
+
+        async def recording_send(message):
+            messages.append(self._copy(message))
+            await send(message)
+
+        completed = False
+        try:
+            await call(recording_send)
+            completed = True
+        finally:
+            del self._flights[key]
+            flight.set_result(messages if completed else None)
+
+    # Os middlewares externos (como o CORS) alteram as mensagens e a lista de
+    # headers no próprio lugar, então cada requisição recebe a sua cópia
+    @staticmethod
+    def _copy(message):
+        message = dict(message)
+        if 'headers' in message:
+            message['headers'] = list(message['headers'])
+        return message
+
+    def metrics(self):
+        return dict(in_flight=len(self._flights), coalesced=self.coalesced)
+
+
+bulkheads = {
+    'read': Bulkhead(config.READ_CONCURRENCY, config.READ_QUEUE_SIZE, config.QUEUE_TIMEOUT),
+    'write': Bulkhead(config.WRITE_CONCURRENCY, config.WRITE_QUEUE_SIZE, config.QUEUE_TIMEOUT),
+}
+rate_limiter = RateLimiter(config.RATE_LIMIT, config.RATE_LIMIT_BURST, config.RATE_LIMIT_MAX_CLIENTS)
+single_flight = SingleFlight()
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # Requisições que pedem profiling precisam rodar o endpoint, não receber uma cópia
+        self.no_coalesce_headers = CREDENTIAL_HEADERS + (config.PROFILING_HEADER.lower().encode('latin-1'),)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http'
+            or scope['method'] == 'OPTIONS'
+            or not scope['path'].startswith(ADMISSION_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        client = scope['client'][0] if scope.get('client') else None
+        wait = rate_limiter.acquire(client)
+        if wait:
+            response = JSONResponse(
+                {'detail': 'Too many requests'},
+                status_code=429,
+                headers={'Retry-After': str(math.ceil(wait))},
+            )
+            await response(scope, receive, send)
+            return
+
+        group = 'read' if scope['method'] in READ_METHODS else 'write'
+
+        async def call(send):
+            await self.admit(bulkheads[group], scope, receive, send)
+
+        if scope['method'] == 'GET' and config.COALESCE_READS and self.can_coalesce(scope):
+            await single_flight.run((scope['path'], scope['query_string']), call, send)
+        else:
+            await call(send)
+
+    def can_coalesce(self, scope):
+        return not any(name in self.no_coalesce_headers for name, _ in scope['headers'])
+
+    async def admit(self, bulkhead, scope, receive, send):
+        if not await bulkhead.acquire():
+            response = JSONResponse(
+                {'detail': 'Server is busy, try again later'},
+                status_code=503,
+                headers={'Retry-After': str(config.RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
+
+
+def metrics():
+    return dict(
+        groups={name: bulkhead.metrics() for name, bulkhead in bulkheads.items()},
+        rate_limit=rate_limiter.metrics(),
+        coalescing=single_flight.metrics(),
+    )
@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import tempfile
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database.models as models
+from database.columnar import PlanetColumns, search_planet_ids_sql
+
+CLIMATES = ['arid', 'temperate', 'tropical', 'frozen', 'murky', 'windy', 'hot', 'humid', 'polluted', 'superheated']
+
+QUERIES = {
+    'population range, order by diameter': dict(
+        min_population=1000000, max_population=1000000000, order_by='diameter', descending=True, limit=100,
+    ),
+    'climate + diameter range, order by population': dict(
+        climate='frozen', min_diameter=5000, max_diameter=15000, order_by='population', limit=100,
+    ),
+    'official planets, top 10 by diameter': dict(
+        official=True, order_by='diameter', descending=True, limit=10,
+    ),
+}
+
+
+def populate(db, rows, seed):
+    rng = random.Random(seed)
+    batch = list()
+    for id in range(1, rows + 1):
+        batch.append(dict(
+            id=id,
+            name=f'Planet {id}',
+            climates=', '.join(rng.sample(CLIMATES, rng.randint(1, 3))),
+            diameter=rng.uniform(1000, 200000) if rng.random() > 0.1 else None,
+            population=int(10 ** rng.uniform(0, 12)) if rng.random() > 0.1 else None,
+            official=rng.random() < 0.01,
+        ))
+        if len(batch) == 50000:
+            db.execute(models.Planet.__table__.insert(), batch)
+            batch = list()
+    if batch:
+        db.execute(models.Planet.__table__.insert(), batch)
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare /planet/search engines: columnar (numpy) vs SQL.')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "benchmark.db")}')
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        print(f'Inserting {args.rows} planets...')
+        populate(db, args.rows, args.seed)
+
+        columns = PlanetColumns()
+        load_time = timeit.timeit(lambda: columns.load(db), number=1)
+        memory = sum(getattr(columns, name).nbytes for name in columns._columns())
+        print(f'Columnar load: {load_time:.2f}s, {memory / args.rows:.0f} bytes per planet')
+
+        for description, filters in QUERIES.items():
+            columnar_ids = columns.search(db, **filters)
+            sql_ids = search_planet_ids_sql(db, **filters)
+            assert columnar_ids == sql_ids, f'engines disagree on "{description}"'
+
+            columnar_time = min(timeit.repeat(lambda: columns.search(db, **filters), number=1, repeat=args.repeat))
+            sql_time = min(timeit.repeat(lambda: search_planet_ids_sql(db, **filters), number=1, repeat=args.repeat))
+            print(
+                f'{description}: columnar {columnar_time * 1000:.1f}ms, '
+                f'sql {sql_time * 1000:.1f}ms ({sql_time / columnar_time:.0f}x)'
+            )
+
+        db.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
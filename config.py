@@ -0,0 +1,37 @@
+import os
+
+
+def env_flag(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+# Engine usada em /planet/search: "columnar" (requer numpy) ou "sql"
+PLANET_READ_ENGINE = os.environ.get('PLANET_READ_ENGINE', 'columnar')
+
+# Profiling por requisição: são perfiladas as requisições que enviam o token
+# no header abaixo ou que forem sorteadas pela taxa de amostragem (de 0 a 1).
+# O mesmo token é exigido nas rotas /admin/profiles; sem token elas ficam fechadas.
+PROFILING_ENABLED = env_flag('PROFILING_ENABLED')
+PROFILING_HEADER = os.environ.get('PROFILING_HEADER', 'X-Profile')
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_BUFFER_SIZE = int(os.environ.get('PROFILING_BUFFER_SIZE', 50))
+
+# Controle de admissão das rotas /film e /planet: requisições simultâneas
+# por grupo (leitura e escrita), tamanho da fila de espera e tempo máximo
+# na fila (segundos) antes de responder 503
+READ_CONCURRENCY = int(os.environ.get('READ_CONCURRENCY', 16))
+READ_QUEUE_SIZE = int(os.environ.get('READ_QUEUE_SIZE', 32))
+WRITE_CONCURRENCY = int(os.environ.get('WRITE_CONCURRENCY', 4))
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 8))
+QUEUE_TIMEOUT = float(os.environ.get('QUEUE_TIMEOUT', 2))
+RETRY_AFTER = int(os.environ.get('RETRY_AFTER', 1))
+
+# Leituras idênticas em andamento compartilham a mesma resposta
+COALESCE_READS = env_flag('COALESCE_READS', True)
+
+# Token bucket por cliente: requisições por segundo e rajada máxima (0 desabilita).
+# O cliente é o IP da conexão, então atrás de um proxy reverso todos dividem o mesmo bucket.
+RATE_LIMIT = float(os.environ.get('RATE_LIMIT', 0))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 100))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000))
@@ -0,0 +1,308 @@
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional, instalado com o extra "columnar"
+    np = None
+
+import config
+import database.models as models
+
+MAX_CLIMATES = 64
+# Faixa dos inteiros do SQLite e da coluna de população
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+def split_climates(climates):
+    if not climates:
+        return []
+    return [climate.strip().lower() for climate in climates.split(',') if climate.strip()]
+
+
+# Cópia em memória, por colunas, dos campos de planeta usados nas buscas.
+# Cada planeta ocupa 35 bytes: id, população (int64, com flag de valor conhecido),
+# diâmetro (NaN quando desconhecido), bitmask de climas, flag official e flag de linha viva.
+class PlanetColumns:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._pending = None
+        self._climate_bits = dict()
+        self._climate_overflow = False
+
+    @property
+    def enabled(self):
+        return np is not None and config.PLANET_READ_ENGINE == 'columnar'
+
+    def _columns(self):
+        return ('_ids', '_population', '_population_known', '_diameter', '_climates', '_official', '_alive')
+
+    def _build(self, db):
+        rows = db.query(
+            models.Planet.id,
+            models.Planet.population,
+            models.Planet.diameter,
+            models.Planet.climates,
+            models.Planet.official,
+        ).order_by(models.Planet.id).all()
+        ids, populations, diameters, climates, officials = zip(*rows) if rows else ((),) * 5
+
+        climate_bits = dict()
+        climate_overflow = False
+        masks = dict()
+        for planet_climates in set(climates):
+            masks[planet_climates], overflow = climate_mask(planet_climates, climate_bits)
+            climate_overflow |= overflow
+
+        population_known = np.array([population is not None for population in populations], dtype=np.bool_)
+        columns = dict(
+            _ids=np.array(ids, dtype=np.int64),
+            _population=np.array(
+                [population if population is not None else 0 for population in populations],
+                dtype=np.int64,
+            ),
+            _population_known=population_known,
+            # None vira NaN no diâmetro
+            _diameter=np.array(diameters, dtype=np.float64),
+            _climates=np.array([masks[planet_climates] for planet_climates in climates], dtype=np.uint64),
+            _official=np.array(officials, dtype=np.bool_),
+            _alive=np.ones(len(rows), dtype=np.bool_),
+        )
+        return columns, climate_bits, climate_overflow
+
+    def _swap(self, columns, climate_bits, climate_overflow):
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self._climate_bits = climate_bits
+        self._climate_overflow = climate_overflow
+        self._size = len(columns['_ids'])
+        self._removed = 0
+        self._loaded = True
+
+    def load(self, db):
+        built = self._build(db)
+        with self._lock:
+            self._swap(*built)
+
+    def _ensure_loaded(self, db):
+        if self._loaded:
+            return
+
+        # As colunas são montadas fora de _lock para não travar as escritas.
+        # Planetas alterados durante a montagem são relidos do banco no final.
+        with self._load_lock:
+            if self._loaded:
+                return
+
+            with self._lock:
+                self._pending = set()
+
+            built = self._build(db)
+
+            with self._lock:
+                pending = self._pending
+                self._pending = None
+                self._swap(*built)
+
+                for planet_id in pending:
+                    self._refresh(db, planet_id)
+
+    # Relê do banco, sob o lock, o planeta já commitado. Assim a ordem em que
+    # escritas concorrentes chegam aqui não importa.
+    def refresh(self, db, planet_id):
+        with self._lock:
+            if self._loaded:
+                self._refresh(db, planet_id)
+            elif self._pending is not None:
+                self._pending.add(planet_id)
+
+    def _refresh(self, db, planet_id):
+        planet_db = db.query(models.Planet).filter(models.Planet.id == planet_id).first()
+        if planet_db is None:
+            self._remove(planet_id)
+        else:
+            self._upsert(planet_db)
+
+    def _write(self, row, id, population, diameter, climates, official):
+        self._ids[row] = id
+        self._population[row] = population if population is not None else 0
+        self._population_known[row] = population is not None
+        self._diameter[row] = diameter if diameter is not None else np.nan
+        self._climates[row], overflow = climate_mask(climates, self._climate_bits)
+        self._climate_overflow |= overflow
+        self._official[row] = bool(official)
+        self._alive[row] = True
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._ids))
+        for name in self._columns():
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def _upsert(self, planet_db):
+        row = int(np.searchsorted(self._ids[:self._size], planet_db.id))
+        if row == self._size or self._ids[row] != planet_db.id:
+            # Ids são crescentes, então normalmente isso é um append
+            if self._size == len(self._ids):
+                self._grow()
+            for name in self._columns():
+                column = getattr(self, name)
+                column[row + 1:self._size + 1] = column[row:self._size]
+            self._size += 1
+        elif not self._alive[row]:
+            self._removed -= 1
+
+        self._write(
+            row,
+            planet_db.id,
+            planet_db.population,
+            planet_db.diameter,
+            planet_db.climates,
+            planet_db.official,
+        )
+
+    def _remove(self, planet_id):
+        row = int(np.searchsorted(self._ids[:self._size], planet_id))
+        if row == self._size or self._ids[row] != planet_id or not self._alive[row]:
+            return
+
+        self._alive[row] = False
+        self._removed += 1
+
+        # Compacta quando metade das linhas já foi removida
+        if 2 * self._removed > self._size:
+            alive = self._alive[:self._size].copy()
+            for name in self._columns():
+                column = getattr(self, name)
+                kept = column[:self._size][alive]
+                column[:len(kept)] = kept
+            self._size -= self._removed
+            self._removed = 0
+
+    def search(self, db, min_population=None, max_population=None, min_diameter=None,
+               max_diameter=None, climate=None, official=None, order_by='id',
+               descending=False, limit=100):
+        self._ensure_loaded(db)
+
+        with self._lock:
+            climate_bit = None
+            if climate is not None:
+                climate_bit = self._climate_bits.get(climate.strip().lower())
+                if climate_bit is None:
+                    # Climas fora da bitmask só podem ser buscados pelo SQL
+                    return None if self._climate_overflow else []
+
+            size = self._size
+            mask = self._alive[:size].copy()
+            if min_population is not None or max_population is not None:
+                mask &= self._population_known[:size]
+            if min_population is not None:
+                mask &= self._population[:size] >= clamp_int64(min_population)
+            if max_population is not None:
+                mask &= self._population[:size] <= clamp_int64(max_population)
+            if min_diameter is not None:
+                mask &= self._diameter[:size] >= min_diameter
+            if max_diameter is not None:
+                mask &= self._diameter[:size] <= max_diameter
+            if climate_bit is not None:
+                mask &= (self._climates[:size] & np.uint64(1 << climate_bit)) != 0
+            if official is not None:
+                mask &= self._official[:size] == official
+
+            rows = np.flatnonzero(mask)
+            ids = self._ids[rows]
+
+            if order_by == 'id':
+                ids = ids[::-1][:limit] if descending else ids[:limit]
+                return ids.tolist()
+
+            if order_by == 'population':
+                values = self._population[rows]
+                known = self._population_known[rows]
+            else:
+                values = self._diameter[rows]
+                known = ~np.isnan(values)
+
+        # ~x inverte a ordem de inteiros sem estourar como -x faria
+        if order_by == 'population':
+            keys = ~values if descending else values
+            keys[~known] = INT64_MAX
+        else:
+            keys = -values if descending else values
+            keys[~known] = np.inf
+
+        if limit < len(keys):
+            kth = np.partition(keys, limit - 1)[limit - 1]
+            candidates = keys <= kth
+            keys, ids, known = keys[candidates], ids[candidates], known[candidates]
+
+        # Valores desconhecidos ficam sempre no final, como no SQL
+        order = np.lexsort((ids, keys, ~known))[:limit]
+        return ids[order].tolist()
+
+
+def climate_mask(climates, climate_bits):
+    mask = 0
+    overflow = False
+    for climate in split_climates(climates):
+        bit = climate_bits.get(climate)
+        if bit is None:
+            if len(climate_bits) == MAX_CLIMATES:
+                overflow = True
+                continue
+            bit = climate_bits[climate] = len(climate_bits)
+        mask |= 1 << bit
+    return mask, overflow
+
+
+def clamp_int64(value):
+    return min(max(int(value), INT64_MIN), INT64_MAX)
+
+
+def search_planet_ids_sql(db, min_population=None, max_population=None, min_diameter=None,
+                          max_diameter=None, climate=None, official=None, order_by='id',
+                          descending=False, limit=100):
+    query = db.query(models.Planet.id, models.Planet.climates)
+
+    if min_population is not None:
+        query = query.filter(models.Planet.population >= clamp_int64(min_population))
+    if max_population is not None:
+        query = query.filter(models.Planet.population <= clamp_int64(max_population))
+    if min_diameter is not None:
+        query = query.filter(models.Planet.diameter >= min_diameter)
+    if max_diameter is not None:
+        query = query.filter(models.Planet.diameter <= max_diameter)
+    if climate is not None:
+        climate = climate.strip().lower()
+        query = query.filter(models.Planet.climates.like(f'%{climate}%'))
+    if official is not None:
+        query = query.filter(models.Planet.official == official)
+
+    if order_by == 'id':
+        query = query.order_by(models.Planet.id.desc() if descending else models.Planet.id)
+    else:
+        column = getattr(models.Planet, order_by)
+        query = query.order_by(
+            column.is_(None),
+            column.desc() if descending else column,
+            models.Planet.id,
+        )
+
+    if climate is None:
+        return [id for id, _ in query.limit(limit)]
+
+    # LIKE também casa trechos de outros climas ("arid" em "semi-arid")
+    ids = list()
+    for id, climates in query.yield_per(1000):
+        if climate in split_climates(climates):
+            ids.append(id)
+            if len(ids) == limit:
+                break
+    return ids
+
+
+planet_columns = PlanetColumns()
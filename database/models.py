@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey
 from sqlalchemy.orm import relationship
-from sqlalchemy.types import Date
+from sqlalchemy.types import Date, DateTime
 from database.database import Base
 
 class Association(Base):
@@ -28,3 +28,9 @@ class Planet(Base):
     population = Column(Integer, nullable=True)
     official = Column(Boolean, default=False)
     films = relationship("Association", back_populates="planet")
+
+class Snapshot(Base):
+    __tablename__ = 'snapshot'
+    name = Column(String, primary_key=True)
+    checksum = Column(String(64))
+    loaded_at = Column(DateTime)
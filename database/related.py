@@ -0,0 +1,216 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+
+import database.models as models
+
+MAX_RELATED = 100
+# Limites de cada cache de rankings (há um para filmes e outro para planetas).
+# Cada par (id, contagem) ocupa 16 bytes e cada ranking tem ~280 bytes fixos,
+# então cada cache usa no máximo ~11 MB (8 MB de pares + 2,8 MB fixos).
+RANKING_CACHE_SIZE = 10000
+RANKING_CACHE_ITEMS = 500000
+
+
+# Rankings guardados como dois arrays (ids e contagens), com LRU limitado pelo
+# número de rankings e pelo total de pares guardados
+class RankingCache:
+    def __init__(self, max_size=RANKING_CACHE_SIZE, max_items=RANKING_CACHE_ITEMS):
+        self.max_size = max_size
+        self.max_items = max_items
+        self.items = 0
+        self._rankings = OrderedDict()
+
+    def __len__(self):
+        return len(self._rankings)
+
+    def get(self, key):
+        ranking = self._rankings.get(key)
+        if ranking is not None:
+            self._rankings.move_to_end(key)
+        return ranking
+
+    def put(self, key, ranking):
+        self.pop(key)
+        self._rankings[key] = ranking
+        self.items += len(ranking[0])
+        while len(self._rankings) > self.max_size or self.items > self.max_items:
+            _, (ids, _) = self._rankings.popitem(last=False)
+            self.items -= len(ids)
+
+    def pop(self, key):
+        ranking = self._rankings.pop(key, None)
+        if ranking is not None:
+            self.items -= len(ranking[0])
+
+    def clear(self):
+        self._rankings.clear()
+        self.items = 0
+
+
+# Índice em memória das associações filme-planeta. Cada lado guarda os vizinhos
+# em arrays ordenados de ids (8 bytes por associação). O ranking de relacionados
+# de cada filme/planeta é calculado na primeira consulta, percorrendo os vizinhos
+# dos vizinhos, e fica em cache até alguma associação envolvida mudar.
+class RelatedIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._pending = None
+        self._film_planets = dict()
+        self._planet_films = dict()
+        self._film_rankings = RankingCache()
+        self._planet_rankings = RankingCache()
+
+    def _build(self, db):
+        film_planets = dict()
+        planet_films = dict()
+        rows = db.query(models.Association.film_id, models.Association.planet_id) \
+            .order_by(models.Association.film_id, models.Association.planet_id)
+        for film_id, planet_id in rows:
+            film_planets.setdefault(film_id, array('q')).append(planet_id)
+            planet_films.setdefault(planet_id, array('q')).append(film_id)
+
+        # Linhas vêm ordenadas por filme, então só as listas de filmes precisam ser ordenadas
+        for film_ids in planet_films.values():
+            film_ids[:] = array('q', sorted(film_ids))
+
+        return film_planets, planet_films
+
+    def _ensure_loaded(self, db):
+        if self._loaded:
+            return
+
+        # O índice é montado fora de _lock para não travar as escritas. Filmes e
+        # planetas alterados durante a montagem são relidos do banco no final.
+        with self._load_lock:
+            if self._loaded:
+                return
+
+            with self._lock:
+                self._pending = (set(), set())
+
+            film_planets, planet_films = self._build(db)
+
+            with self._lock:
+                touched_films, touched_planets = self._pending
+                self._film_planets = film_planets
+                self._planet_films = planet_films
+                self._film_rankings.clear()
+                self._planet_rankings.clear()
+                self._pending = None
+                self._loaded = True
+
+                for film_id in touched_films:
+                    self._refresh_film(db, film_id)
+                for planet_id in touched_planets:
+                    self._refresh_planet(db, planet_id)
+
+    # Os métodos refresh_* releem do banco, sob o lock, as associações já
+    # commitadas. Assim a ordem em que escritas concorrentes chegam aqui não
+    # importa: a última leitura sempre reflete o estado mais recente.
+    def refresh_film(self, db, film_id):
+        with self._lock:
+            if self._loaded:
+                self._refresh_film(db, film_id)
+            elif self._pending is not None:
+                self._pending[0].add(film_id)
+
+    def refresh_planet(self, db, planet_id):
+        with self._lock:
+            if self._loaded:
+                self._refresh_planet(db, planet_id)
+            elif self._pending is not None:
+                self._pending[1].add(planet_id)
+
+    def _refresh_film(self, db, film_id):
+        planet_ids = [
+            planet_id for planet_id, in
+            db.query(models.Association.planet_id).filter(models.Association.film_id == film_id)
+        ]
+        links = {(film_id, planet_id) for planet_id in planet_ids}
+        changed = links ^ {(film_id, planet_id) for planet_id in self._film_planets.get(film_id, ())}
+        self._replace(self._film_planets, self._planet_films, film_id, planet_ids, changed)
+
+    def _refresh_planet(self, db, planet_id):
+        film_ids = [
+            film_id for film_id, in
+            db.query(models.Association.film_id).filter(models.Association.planet_id == planet_id)
+        ]
+        links = {(film_id, planet_id) for film_id in film_ids}
+        changed = links ^ {(film_id, planet_id) for film_id in self._planet_films.get(planet_id, ())}
+        self._replace(self._planet_films, self._film_planets, planet_id, film_ids, changed)
+
+    def related_planets(self, db, planet_id, limit):
+        self._ensure_loaded(db)
+        with self._lock:
+            ids, counts = self._ranking(self._planet_rankings, self._planet_films, self._film_planets, planet_id)
+            return list(zip(ids[:limit], counts[:limit]))
+
+    def related_films(self, db, film_id, limit):
+        self._ensure_loaded(db)
+        with self._lock:
+            ids, counts = self._ranking(self._film_rankings, self._film_planets, self._planet_films, film_id)
+            return list(zip(ids[:limit], counts[:limit]))
+
+    def _invalidate(self, links):
+        # Uma associação (filme, planeta) altera o ranking do planeta e de todos
+        # os planetas do filme, e o ranking do filme e de todos os filmes do planeta
+        for film_id, planet_id in links:
+            self._planet_rankings.pop(planet_id)
+            for other_planet_id in self._film_planets.get(film_id, ()):
+                self._planet_rankings.pop(other_planet_id)
+            self._film_rankings.pop(film_id)
+            for other_film_id in self._planet_films.get(planet_id, ()):
+                self._film_rankings.pop(other_film_id)
+
+    def _replace(self, forward, backward, key, neighbours, changed):
+        if not changed:
+            return
+
+        # Invalida antes e depois da troca para cobrir associações removidas e adicionadas
+        self._invalidate(changed)
+
+        old = set(forward.get(key, ()))
+        new = set(neighbours)
+
+        # Adiciona ligações
+        for neighbour in new - old:
+            insort(backward.setdefault(neighbour, array('q')), key)
+
+        # Remove ligações
+        for neighbour in old - new:
+            keys = backward[neighbour]
+            del keys[bisect_left(keys, key)]
+            if not keys:
+                del backward[neighbour]
+
+        if new:
+            forward[key] = array('q', sorted(new))
+        else:
+            forward.pop(key, None)
+
+        self._invalidate(changed)
+
+    @staticmethod
+    def _ranking(cache, forward, backward, key):
+        ranking = cache.get(key)
+        if ranking is not None:
+            return ranking
+
+        counts = Counter()
+        for neighbour in forward.get(key, ()):
+            counts.update(backward[neighbour])
+        counts.pop(key, None)
+
+        top = heapq.nlargest(MAX_RELATED, counts.items(), key=lambda item: (item[1], -item[0]))
+        ranking = (array('q', [id for id, _ in top]), array('q', [count for _, count in top]))
+        cache.put(key, ranking)
+
+        return ranking
+
+
+related_index = RelatedIndex()
@@ -1,6 +1,12 @@
 from fastapi import APIRouter
-from endpoints import films, planets 
+
+import config
+from endpoints import films, metrics, planets, profiles
 
 router = APIRouter()
 router.include_router(films.router)
 router.include_router(planets.router)
+router.include_router(metrics.router)
+
+if config.PROFILING_ENABLED:
+    router.include_router(profiles.router)
@@ -1,18 +1,20 @@
 from msilib import schema
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, Query, status, APIRouter
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List
 
-import database.models as models, schemas as schemas
+import database.models as models, profiling, schemas as schemas
+from database.related import MAX_RELATED, related_index
 from main import get_db
-from schemas.films import FilmRequest, FilmUpdateRequest, FilmResponse
+from schemas.films import FilmRequest, FilmUpdateRequest, FilmResponse, RelatedFilmResponse
 
 
 router = APIRouter(
     prefix="/film",
     tags=["Film"],
     responses={404: {"description": "Not found"}},
+    route_class=profiling.route_class,
 )
 
 @router.get("/", response_model=List[FilmResponse])
@@ -48,6 +50,20 @@ def show_film(id: int, db: Session = Depends(get_db)):
 
     return response
 
+@router.get("/{id}/related", response_model=List[RelatedFilmResponse])
+def show_related_films(id: int, limit: int = Query(10, gt=0, le=MAX_RELATED), db: Session = Depends(get_db)):
+    film_db = db.query(models.Film).get(id)
+
+    if not film_db:
+        raise HTTPException(status_code=404, detail=f'Film with id {id} not found')
+
+    response = [
+        RelatedFilmResponse(id=film_id, shared_planets=shared_planets)
+        for film_id, shared_planets in related_index.related_films(db, id, limit)
+    ]
+
+    return response
+
 @router.post("/create/", response_model=FilmResponse, status_code=status.HTTP_201_CREATED)
 def create_film(film: FilmRequest, db: Session = Depends(get_db)):
     
@@ -86,6 +102,7 @@ def create_film(film: FilmRequest, db: Session = Depends(get_db)):
         release_date=film_db.release_date,
         planets=[association.planet_id for association in film_db.planets],
     )
+    related_index.refresh_film(db, film_db.id)
     
     return response
 
@@ -140,6 +157,7 @@ def update_film(id: int, film: FilmUpdateRequest, db: Session = Depends(get_db))
         release_date=film_db.release_date,
         planets=[association.planet_id for association in film_db.planets],
     )
+    related_index.refresh_film(db, film_db.id)
     return response
 
 @router.delete("/{id}/delete", status_code=status.HTTP_204_NO_CONTENT)
@@ -155,5 +173,6 @@ def delete_film(id: int, db: Session = Depends(get_db)):
 
     db.delete(film_db)
     db.commit()
+    related_index.refresh_film(db, id)
     
     return
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+
+import admission
+from schemas.metrics import MetricsResponse
+
+router = APIRouter(
+    prefix="/admin/metrics",
+    tags=["Admin"],
+)
+
+@router.get("/", response_model=MetricsResponse)
+def show_metrics():
+    return MetricsResponse(**admission.metrics())
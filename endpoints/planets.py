@@ -1,16 +1,19 @@
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, Query, status, APIRouter
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional
 
-import database.models as models
-from schemas.planets import PlanetRequest, PlanetUpdateRequest, PlanetResponse
+import database.models as models, profiling
+from database.columnar import planet_columns, search_planet_ids_sql
+from database.related import MAX_RELATED, related_index
+from schemas.planets import PlanetRequest, PlanetUpdateRequest, PlanetResponse, RelatedPlanetResponse, PlanetOrder
 from main import get_db
 
 router = APIRouter(
     prefix="/planet",
     tags=["Planet"],
     responses={404: {"description": "Not found"}},
+    route_class=profiling.route_class,
 )
 
 @router.get("/", response_model=List[PlanetResponse])
@@ -32,6 +35,57 @@ def show_all_planets(db: Session = Depends(get_db)):
     
     return response
 
+@router.get("/search", response_model=List[PlanetResponse])
+def search_planets(
+    min_population: Optional[int] = None,
+    max_population: Optional[int] = None,
+    min_diameter: Optional[float] = None,
+    max_diameter: Optional[float] = None,
+    climate: Optional[str] = None,
+    official: Optional[bool] = None,
+    order_by: PlanetOrder = PlanetOrder.id,
+    descending: bool = False,
+    limit: int = Query(100, gt=0, le=1000),
+    db: Session = Depends(get_db),
+):
+    filters = dict(
+        min_population=min_population,
+        max_population=max_population,
+        min_diameter=min_diameter,
+        max_diameter=max_diameter,
+        climate=climate,
+        official=official,
+        order_by=order_by.value,
+        descending=descending,
+        limit=limit,
+    )
+
+    ids = planet_columns.search(db, **filters) if planet_columns.enabled else None
+    if ids is None:
+        ids = search_planet_ids_sql(db, **filters)
+
+    # Associações carregadas numa única query em vez de uma por planeta
+    planets_db = db.query(models.Planet) \
+        .options(selectinload(models.Planet.films)) \
+        .filter(models.Planet.id.in_(ids))
+    planets_db = {planet_db.id: planet_db for planet_db in planets_db}
+    response = list()
+
+    # Ignora planetas removidos depois da busca
+    for planet_db in [planets_db[id] for id in ids if id in planets_db]:
+        response.append(
+            PlanetResponse(
+                id=planet_db.id, 
+                name=planet_db.name, 
+                climates=planet_db.climates,
+                diameter=planet_db.diameter,
+                population=planet_db.population,
+                films=[association.film_id for association in planet_db.films],
+            )
+        )
+
+    return response
+
 @router.get("/{id}", response_model=PlanetResponse)
 def show_planet(id: int, db: Session = Depends(get_db)):
     planet_db = db.query(models.Planet).get(id)
@@ -50,6 +104,20 @@ def show_planet(id: int, db: Session = Depends(get_db)):
 
     return planet
 
+@router.get("/{id}/related", response_model=List[RelatedPlanetResponse])
+def show_related_planets(id: int, limit: int = Query(10, gt=0, le=MAX_RELATED), db: Session = Depends(get_db)):
+    planet_db = db.query(models.Planet).get(id)
+
+    if not planet_db:
+        raise HTTPException(status_code=404, detail=f'Planet with id {id} not found')
+
+    response = [
+        RelatedPlanetResponse(id=planet_id, shared_films=shared_films)
+        for planet_id, shared_films in related_index.related_planets(db, id, limit)
+    ]
+
+    return response
+
 @router.post("/create/", response_model=PlanetResponse, status_code=status.HTTP_201_CREATED)
 def create_planet(planet: PlanetRequest, db: Session = Depends(get_db)):
     
@@ -92,6 +160,8 @@ def create_planet(planet: PlanetRequest, db: Session = Depends(get_db)):
         population=planet_db.population,
         films=[association.film_id for association in planet_db.films],
     )
+    related_index.refresh_planet(db, planet_db.id)
+    planet_columns.refresh(db, planet_db.id)
     
     return response
 
@@ -151,6 +221,8 @@ def update_planet(id: int, planet: PlanetUpdateRequest, db: Session = Depends(ge
         population=planet_db.population,
         films=[association.film_id for association in planet_db.films],
     )
+    related_index.refresh_planet(db, planet_db.id)
+    planet_columns.refresh(db, planet_db.id)
     return response
 
 @router.delete("/{id}/delete", status_code=status.HTTP_204_NO_CONTENT)
@@ -166,5 +238,7 @@ def delete_planet(id: int, db: Session = Depends(get_db)):
 
     db.delete(planet_db)
     db.commit()
+    related_index.refresh_planet(db, id)
+    planet_columns.refresh(db, id)
     
     return
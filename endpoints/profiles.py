@@ -0,0 +1,63 @@
+import marshal
+
+from fastapi import Depends, HTTPException, APIRouter, Request
+from fastapi.responses import Response
+from typing import List
+
+import config
+import profiling
+from schemas.profiles import ProfileSummaryResponse, ProfileResponse, QueryResponse
+
+def check_token(request: Request):
+    token = request.headers.get(config.PROFILING_HEADER)
+
+    if not profiling.valid_token(token.encode('latin-1') if token is not None else None):
+        raise HTTPException(status_code=403, detail='Invalid profiling token')
+
+router = APIRouter(
+    prefix=profiling.ADMIN_PREFIX,
+    tags=["Admin"],
+    dependencies=[Depends(check_token)],
+    responses={403: {"description": "Invalid profiling token"}, 404: {"description": "Not found"}},
+)
+
+def get_profile(id: int):
+    profile = profiling.profiles.get(id)
+
+    if not profile:
+        raise HTTPException(status_code=404, detail=f'Profile with id {id} not found')
+
+    return profile
+
+@router.get("/", response_model=List[ProfileSummaryResponse])
+def show_all_profiles():
+    return [ProfileSummaryResponse(**profile.summary()) for profile in profiling.profiles.all()]
+
+@router.get("/{id}", response_model=ProfileResponse)
+def show_profile(id: int):
+    profile = get_profile(id)
+
+    response = ProfileResponse(
+        **profile.summary(),
+        queries=[
+            QueryResponse(statement=statement, duration_ms=duration * 1000)
+            for statement, duration in profile.queries
+        ],
+    )
+
+    return response
+
+@router.get("/{id}/pstats")
+def download_profile_pstats(id: int):
+    profile = get_profile(id)
+
+    # Mesmo formato gerado por pstats.Stats.dump_stats
+    return Response(
+        content=marshal.dumps(profile.stats().stats),
+        media_type='application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename="profile-{id}.prof"'},
+    )
+
+@router.get("/{id}/speedscope")
+def download_profile_speedscope(id: int):
+    return get_profile(id).speedscope()
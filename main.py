@@ -4,7 +4,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import RedirectResponse
 
-import database.models as models, star_wars_api
+import admission, config, database.models as models, profiling, star_wars_api
 from database.database import engine, SessionLocal
 
 models.Base.metadata.create_all(bind=engine)
@@ -19,7 +19,12 @@ def get_db():
 
 app = FastAPI()
 
-star_wars_api.download_official_data()
+star_wars_api.load_official_data()
+
+# O último middleware adicionado é o mais externo: o CORS fica por fora do
+# controle de admissão para que respostas 429/503 e leituras coalescidas
+# recebam os headers CORS da própria requisição
+app.add_middleware(admission.AdmissionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +34,9 @@ app.add_middleware(
     allow_credentials=True,
 )
 
+if config.PROFILING_ENABLED:
+    profiling.install(app)
+
 @app.get("/")
 def main():
     return RedirectResponse(url="/docs/")
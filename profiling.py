@@ -0,0 +1,276 @@
+import asyncio
+import contextvars
+import cProfile
+import datetime
+import functools
+import hmac
+import itertools
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+ADMIN_PREFIX = '/admin/profiles'
+SPEEDSCOPE_MAX_DEPTH = 128
+SPEEDSCOPE_MIN_TIME = 1e-6
+
+# A partir do Python 3.12 o cProfile usa sys.monitoring, que registra as chamadas
+# de todas as threads do processo, não só as do endpoint. Com requisições
+# simultâneas os dados do cProfile misturam o trabalho de outras requisições.
+CPROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+class RequestProfile:
+    def __init__(self, id, method, path):
+        self.id = id
+        self.method = method
+        self.path = path
+        self.started_at = datetime.datetime.now()
+        self.status_code = None
+        self.total_time = 0.0
+        self.handler_time = 0.0
+        self.endpoint_time = 0.0
+        self.skipped = False
+        self.mixed = False
+        self.queries = list()
+        self._profilers = list()
+        self._lock = threading.Lock()
+
+    def add_query(self, statement, duration):
+        with self._lock:
+            self.queries.append((statement, duration))
+
+    def add_profiler(self, profiler):
+        with self._lock:
+            self._profilers.append(profiler)
+
+    def summary(self):
+        return dict(
+            id=self.id,
+            method=self.method,
+            path=self.path,
+            status_code=self.status_code,
+            started_at=self.started_at,
+            total_ms=self.total_time * 1000,
+            handler_ms=self.handler_time * 1000,
+            endpoint_ms=self.endpoint_time * 1000,
+            sql_ms=sum(duration for _, duration in self.queries) * 1000,
+            sql_count=len(self.queries),
+            skipped=self.skipped,
+            mixed=self.mixed,
+        )
+
+    def stats(self):
+        with self._lock:
+            return pstats.Stats(*self._profilers)
+
+    def speedscope(self):
+        stats = self.stats().stats
+        name = f'{self.method} {self.path}' + (' (all threads)' if self.mixed else '')
+        frames = list()
+        frame_index = dict()
+        samples = list()
+        weights = list()
+
+        def frame(func):
+            if func not in frame_index:
+                file, line, name = func
+                frame_index[func] = len(frames)
+                frames.append(dict(name=name, file=file, line=line))
+            return frame_index[func]
+
+        callees = dict()
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller, (_, _, _, cumulative) in callers.items():
+                callees.setdefault(caller, list()).append((func, cumulative))
+
+        # O cProfile só guarda pares chamador-chamado, então as pilhas são
+        # reconstruídas dividindo o tempo de cada função entre quem a chamou
+        def expand(func, time_spent, stack):
+            _, _, own_time, cumulative, _ = stats[func]
+            if cumulative <= 0 or time_spent < SPEEDSCOPE_MIN_TIME or len(stack) >= SPEEDSCOPE_MAX_DEPTH:
+                return
+            stack = stack + [frame(func)]
+            share = time_spent / cumulative
+            if own_time * share > 0:
+                samples.append(stack)
+                weights.append(own_time * share)
+            for callee, callee_time in callees.get(func, ()):
+                if frame_index.get(callee) not in stack:
+                    expand(callee, callee_time * share, stack)
+
+        for func, (_, _, _, cumulative, callers) in stats.items():
+            if not callers:
+                expand(func, cumulative, [])
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'api-starwars',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+
+class ProfileStore:
+    def __init__(self, size):
+        self._profiles = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def create(self, method, path):
+        return RequestProfile(next(self._ids), method, path)
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile.id == id), None)
+
+    def all(self):
+        with self._lock:
+            return list(self._profiles)
+
+
+profiles = ProfileStore(config.PROFILING_BUFFER_SIZE)
+
+
+def valid_token(token):
+    if not config.PROFILING_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token, config.PROFILING_TOKEN.encode('latin-1'))
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.header = config.PROFILING_HEADER.lower().encode('latin-1')
+
+    def should_profile(self, scope):
+        if scope['path'].startswith(ADMIN_PREFIX):
+            return False
+        for name, value in scope['headers']:
+            if name == self.header:
+                return valid_token(value)
+        return random.random() < config.PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiles.create(scope['method'], scope['path'])
+        token = current_profile.set(profile)
+
+        async def profiled_send(message):
+            if message['type'] == 'http.response.start':
+                profile.status_code = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', str(profile.id).encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            profile.total_time = time.perf_counter() - start
+            current_profile.reset(token)
+            profiles.add(profile)
+
+
+def profile_endpoint(endpoint):
+    # Endpoints síncronos rodam no threadpool, então o cProfile precisa ser
+    # ligado na própria thread do endpoint. Rotas são recriadas a cada
+    # include_router, por isso endpoints já instrumentados são mantidos.
+    if asyncio.iscoroutinefunction(endpoint) or getattr(endpoint, 'profiled', False):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    def profiled_endpoint(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+
+        # A partir do Python 3.12 só um profiler pode estar ativo no processo,
+        # então requisições perfiladas em paralelo seguem sem o cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profile.skipped = True
+            profiler = None
+        else:
+            profile.mixed = CPROFILE_ALL_THREADS
+
+        start = time.perf_counter()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.endpoint_time += time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                profile.add_profiler(profiler)
+
+    profiled_endpoint.profiled = True
+    return profiled_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profile_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        # Tempo do handler inclui validação, endpoint e serialização da resposta
+        async def profiled_handler(request):
+            profile = current_profile.get()
+            if profile is None:
+                return await handler(request)
+
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                profile.handler_time += time.perf_counter() - start
+
+        return profiled_handler
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault('profiling_start', list()).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is not None and conn.info.get('profiling_start'):
+        profile.add_query(statement, time.perf_counter() - conn.info['profiling_start'].pop())
+
+
+def install(app):
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.add_middleware(ProfilingMiddleware)
+
+
+route_class = ProfiledRoute if config.PROFILING_ENABLED else APIRoute
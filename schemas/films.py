@@ -28,3 +28,10 @@ class FilmResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+class RelatedFilmResponse(BaseModel):
+    id: int
+    shared_planets: int
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,27 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class GroupMetricsResponse(BaseModel):
+    limit: int
+    queue_size: int
+    active: int
+    queued: int
+    admitted: int
+    shed: int
+
+class RateLimitMetricsResponse(BaseModel):
+    rate: float
+    burst: int
+    clients: int
+    limited: int
+
+class CoalescingMetricsResponse(BaseModel):
+    in_flight: int
+    coalesced: int
+
+class MetricsResponse(BaseModel):
+    groups: Dict[str, GroupMetricsResponse]
+    rate_limit: RateLimitMetricsResponse
+    coalescing: CoalescingMetricsResponse
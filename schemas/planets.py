@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Optional, List
 
 from pydantic import BaseModel, validator
@@ -57,3 +58,15 @@ class PlanetResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+class RelatedPlanetResponse(BaseModel):
+    id: int
+    shared_films: int
+
+    class Config:
+        orm_mode = True
+
+class PlanetOrder(str, Enum):
+    id = 'id'
+    population = 'population'
+    diameter = 'diameter'
@@ -0,0 +1,26 @@
+from typing import Optional, List
+
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class QueryResponse(BaseModel):
+    statement: str
+    duration_ms: float
+
+class ProfileSummaryResponse(BaseModel):
+    id: int
+    method: str
+    path: str
+    status_code: Optional[int] = None
+    started_at: datetime
+    total_ms: float
+    handler_ms: float
+    endpoint_ms: float
+    sql_ms: float
+    sql_count: int
+    skipped: bool
+    mixed: bool
+
+class ProfileResponse(ProfileSummaryResponse):
+    queries: List[QueryResponse]
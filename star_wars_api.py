@@ -1,88 +1,192 @@
+import argparse
 import datetime
+import gzip
+import hashlib
+import json
+import os
 import requests
 
 from database.database import SessionLocal
 import database.models as models
 
+SWAPI_URL = 'https://swapi.dev/api'
+SNAPSHOT_NAME = 'official'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'official.json.gz')
 
-def download_official_data():
+
+def load_official_data(path=SNAPSHOT_PATH):
     db = SessionLocal()
-    qtd_films = db.query(models.Film).filter(models.Film.official == True).count()
-    qtd_planets = db.query(models.Planet).filter(models.Planet.official == True).count()
-
-    if qtd_films < 6 or qtd_planets < 60:
-        print(f'{datetime.datetime.now()} - Downloading data from swapi.dev')
-        films = request_films(db)
-        print(f'{datetime.datetime.now()} - Films done')
-        request_planets(db, films)
-        print(f'{datetime.datetime.now()} - Planets done')
-        print(f'{datetime.datetime.now()} - Data download completed')
-    else:
-        print(f'{datetime.datetime.now()} - All official data checked')
+    try:
+        if load_snapshot(db, path):
+            print(f'{datetime.datetime.now()} - Official data loaded from {path}')
+        else:
+            print(f'{datetime.datetime.now()} - All official data checked')
+    finally:
+        db.close()
 
 
-def request_films(db):
-    films = dict()
+def read_snapshot(path=SNAPSHOT_PATH):
+    with gzip.open(path, 'rb') as file:
+        content = file.read()
 
-    with requests.get('https://swapi.dev/api/films') as response:
-        response.raise_for_status()
-        json = response.json()
+    snapshot = json.loads(content)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported snapshot version {snapshot.get("version")} in {path}')
 
-    for film_json in json['results']:
-        title = film_json['title']
-        release_date = datetime.datetime.strptime(film_json['release_date'], '%Y-%m-%d').date()
-        film_db = models.Film(
-            title=title,
-            release_date=release_date,
-            official=True,
-        )
+    return snapshot, hashlib.sha256(content).hexdigest()
 
-        film_db_exists = db.query(models.Film).filter_by(title=title).first()
-        if film_db_exists is None:
-            db.add(film_db)
-            db.commit()
-            db.refresh(film_db)
-        else:
-            film_db = film_db_exists
-        
-        films[film_json['url']] = film_db
 
-    return films
+def load_snapshot(db, path=SNAPSHOT_PATH):
+    snapshot, checksum = read_snapshot(path)
+
+    snapshot_db = db.query(models.Snapshot).get(SNAPSHOT_NAME)
+    if snapshot_db is not None and snapshot_db.checksum == checksum:
+        return False
 
-def request_planets(db, films):
-    url = 'https://swapi.dev/api/planets'
+    try:
+        films = {film['title']: film for film in snapshot['films']}
+        film_ids = bulk_upsert(db, models.Film, models.Film.title, films, lambda film: dict(
+            title=film['title'],
+            release_date=datetime.date.fromisoformat(film['release_date']),
+            official=True,
+        ))
+
+        planets = {planet['name']: planet for planet in snapshot['planets']}
+        planet_ids = bulk_upsert(db, models.Planet, models.Planet.name, planets, lambda planet: dict(
+            name=planet['name'],
+            climates=planet['climates'],
+            diameter=planet['diameter'],
+            population=planet['population'],
+            official=True,
+        ))
+
+        # Associações já existentes passam a ser oficiais, as demais são inseridas
+        links = {
+            (film_ids[title], planet_ids[planet['name']])
+            for planet in snapshot['planets'] for title in planet['films']
+        }
+        existing = {
+            (film_id, planet_id)
+            for film_id, planet_id in db.query(models.Association.film_id, models.Association.planet_id)
+                .filter(models.Association.planet_id.in_(list(planet_ids.values())))
+            if (film_id, planet_id) in links
+        }
+        for film_id, planet_id in existing:
+            db.query(models.Association).filter_by(film_id=film_id, planet_id=planet_id).update({'official': True})
+        new_links = sorted(links - existing)
+        if new_links:
+            db.execute(models.Association.__table__.insert(), [
+                dict(film_id=film_id, planet_id=planet_id, official=True) for film_id, planet_id in new_links
+            ])
+
+        if snapshot_db is None:
+            snapshot_db = models.Snapshot(name=SNAPSHOT_NAME)
+            db.add(snapshot_db)
+        snapshot_db.checksum = checksum
+        snapshot_db.loaded_at = datetime.datetime.now()
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+
+    return True
+
+
+# Atualiza as linhas de `model` cuja coluna `key` já existe, insere as demais
+# e retorna o id de cada chave
+def bulk_upsert(db, model, key, values, to_row):
+    ids = dict(db.query(key, model.id).filter(key.in_(values.keys())))
+
+    for value, id in ids.items():
+        db.query(model).filter(model.id == id).update(to_row(values[value]))
+
+    new_rows = [to_row(value) for name, value in values.items() if name not in ids]
+    if new_rows:
+        db.execute(model.__table__.insert(), new_rows)
+        ids.update(db.query(key, model.id).filter(key.in_(values.keys())))
+
+    return ids
+
+
+def request_swapi(url=SWAPI_URL):
+    return {
+        'films': request_all(f'{url}/films'),
+        'planets': request_all(f'{url}/planets'),
+    }
+
+
+def request_all(url):
+    results = list()
     while url:
         with requests.get(url) as response:
             response.raise_for_status()
-            json = response.json()
-
-        for planet_json in json['results']:
-            name = planet_json['name']
-            diameter = planet_json['diameter'] if planet_json['diameter'] != 'unknown' else None
-            climate = planet_json['climate'] if planet_json['climate'] != 'unknown' else None
-            population = planet_json['population'] if planet_json['population'] != 'unknown' else None
-
-            planet_db = models.Planet(
-                name=name,
-                diameter=diameter,
-                climates=climate,
-                population=population,
-                official=True,
-            )
-
-            planet_db_exists = db.query(models.Planet).filter_by(name=name).first()
-            if planet_db_exists is None:
-                for film_url in planet_json['films']:
-                    film_db = films[film_url]
-                    association = models.Association(official=True)
-                    association.film = film_db
-                    planet_db.films.append(association)
-                    db.add(association)
-
-                db.add(planet_db)
-                db.commit()
-                db.refresh(planet_db)
-            else:
-                planet_db = planet_db_exists
-
-        url = json['next']
+            page = response.json()
+
+        results.extend(page['results'])
+        url = page['next']
+
+    return results
+
+
+def build_snapshot(data):
+    films = {film_json['url']: film_json['title'] for film_json in data['films']}
+
+    def known(value):
+        return value if value != 'unknown' else None
+
+    planets = list()
+    for planet_json in data['planets']:
+        diameter = known(planet_json['diameter'])
+        population = known(planet_json['population'])
+        planets.append({
+            'name': planet_json['name'],
+            'climates': known(planet_json['climate']),
+            'diameter': float(diameter) if diameter is not None else None,
+            'population': int(population) if population is not None else None,
+            'films': [films[film_url] for film_url in planet_json['films']],
+        })
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'films': [
+            {'title': film_json['title'], 'release_date': film_json['release_date']}
+            for film_json in data['films']
+        ],
+        'planets': planets,
+    }
+
+
+def write_snapshot(snapshot, path=SNAPSHOT_PATH):
+    content = json.dumps(snapshot, indent=2, ensure_ascii=False).encode('utf-8')
+
+    # mtime fixo para que o mesmo conteúdo gere sempre o mesmo arquivo
+    with open(path, 'wb') as file, gzip.GzipFile(filename='', mode='wb', fileobj=file, mtime=0) as gzip_file:
+        gzip_file.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate the official data snapshot.')
+    parser.add_argument(
+        '--source',
+        default=SWAPI_URL,
+        help='swapi base url, or a JSON file with recorded "films" and "planets" results',
+    )
+    parser.add_argument('--output', default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if os.path.isfile(args.source):
+        with open(args.source, encoding='utf-8') as file:
+            data = json.load(file)
+    else:
+        print(f'{datetime.datetime.now()} - Downloading data from {args.source}')
+        data = request_swapi(args.source)
+
+    snapshot = build_snapshot(data)
+    write_snapshot(snapshot, args.output)
+    print(f'{datetime.datetime.now()} - {len(snapshot["films"])} films and {len(snapshot["planets"])} planets written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,31 @@
+import asyncio
+import cProfile
+import json
+import marshal
 import pytest
 import os
+import sys
+from array import array
 
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 
+import admission
+import config
+import profiling
+import database.models as models
+import star_wars_api
+from database.columnar import PlanetColumns, search_planet_ids_sql
+from database.related import RankingCache, RelatedIndex
 from main import app, get_db
+from endpoints import profiles
+from endpoints.planets import search_planets
+from schemas.planets import PlanetOrder
 from database.database import Base
 
 # CREATE DATABASE FOR TESTS
@@ -29,12 +49,26 @@ app.dependency_overrides[get_db] = override_get_db
 
 client = TestClient(app)
 
+PROFILING_TOKEN = 'profiling-token'
+PROFILE_HEADERS = {'X-Profile': PROFILING_TOKEN}
+
 # Drop databasse after run all tests
 @pytest.fixture(scope='session', autouse=True)
 def drop_test_database():
     yield 
     os.remove('test.db')
 
+# Banco em memória para testes que usam o banco diretamente
+@pytest.fixture
+def memory_db():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+
 
 # --- TESTS ---
 
@@ -111,6 +145,117 @@ def test_planet_read_not_found():
     assert response.status_code == 404
     assert response.json() == {'detail': 'Planet with id 0 not found'}
 
+# PROFILING TESTS
+# A aplicação principal roda com a configuração padrão (profiling desligado),
+# então o profiling é testado numa aplicação própria
+@pytest.fixture
+def profiled_client(monkeypatch):
+    monkeypatch.setattr(config, 'PROFILING_TOKEN', PROFILING_TOKEN)
+
+    router = APIRouter(route_class=profiling.ProfiledRoute)
+
+    @router.get('/planet/')
+    def show_planets(db: Session = Depends(override_get_db)):
+        return [planet_db.name for planet_db in db.query(models.Planet).all()]
+
+    profiled_app = FastAPI()
+    profiled_app.include_router(router)
+    profiled_app.include_router(profiles.router)
+    profiling.install(profiled_app)
+    try:
+        yield TestClient(profiled_app)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', profiling.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', profiling.after_cursor_execute)
+
+def test_profiling_disabled_by_default():
+    assert not config.PROFILING_ENABLED
+    assert profiling.ProfilingMiddleware not in [middleware.cls for middleware in app.user_middleware]
+    assert all(type(route) is APIRoute for route in app.routes if isinstance(route, APIRoute))
+    assert not event.contains(Engine, 'before_cursor_execute', profiling.before_cursor_execute)
+    assert client.get('/admin/profiles/').status_code == 404
+
+    response = client.get('/planet/1', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    assert 'x-profile-id' not in response.headers
+
+def test_profile_request(profiled_client):
+    response = profiled_client.get('/planet/', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    id = int(response.headers['x-profile-id'])
+
+    response = profiled_client.get(f'/admin/profiles/{id}', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    profile = response.json()
+    assert profile['method'] == 'GET'
+    assert profile['path'] == '/planet/'
+    assert profile['status_code'] == 200
+    assert profile['sql_count'] == len(profile['queries']) > 0
+    assert profile['total_ms'] >= profile['handler_ms'] >= profile['endpoint_ms'] > 0
+    assert profile['skipped'] is False
+    assert profile['mixed'] is (sys.version_info >= (3, 12))
+
+    response = profiled_client.get(f'/admin/profiles/{id}/pstats', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    assert any(name == 'show_planets' for _, _, name in marshal.loads(response.content))
+
+    response = profiled_client.get(f'/admin/profiles/{id}/speedscope', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    assert any(frame['name'] == 'show_planets' for frame in response.json()['shared']['frames'])
+
+def test_profile_not_requested(profiled_client):
+    response = profiled_client.get('/planet/')
+    assert response.status_code == 200
+    assert 'x-profile-id' not in response.headers
+
+    response = profiled_client.get('/planet/', headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    assert 'x-profile-id' not in response.headers
+
+def test_profile_skipped(profiled_client, monkeypatch):
+    # Simula o Python 3.12+, onde outro profiler já ativo impede o cProfile de ligar
+    class ActiveProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr(profiling.cProfile, 'Profile', ActiveProfile)
+
+    response = profiled_client.get('/planet/', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    id = int(response.headers['x-profile-id'])
+
+    response = profiled_client.get(f'/admin/profiles/{id}', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    assert response.json()['skipped'] is True
+    assert response.json()['sql_count'] > 0
+
+def test_profile_mixed(profiled_client, monkeypatch):
+    # No Python 3.12+ o cProfile registra todas as threads do processo
+    monkeypatch.setattr(profiling, 'CPROFILE_ALL_THREADS', True)
+
+    response = profiled_client.get('/planet/', headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    id = int(response.headers['x-profile-id'])
+
+    response = profiled_client.get(f'/admin/profiles/{id}', headers=PROFILE_HEADERS)
+    assert response.json()['mixed'] is True
+
+    response = profiled_client.get(f'/admin/profiles/{id}/speedscope', headers=PROFILE_HEADERS)
+    assert response.json()['name'] == 'GET /planet/ (all threads)'
+
+def test_profile_admin_requires_token(profiled_client):
+    response = profiled_client.get('/admin/profiles/')
+    assert response.status_code == 403
+    assert response.json() == {'detail': 'Invalid profiling token'}
+
+    response = profiled_client.get('/admin/profiles/', headers={'X-Profile': 'wrong-token'})
+    assert response.status_code == 403
+
+def test_profile_not_found(profiled_client):
+    response = profiled_client.get('/admin/profiles/0', headers=PROFILE_HEADERS)
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Profile with id 0 not found'}
+
 # UPDATE TESTS
 def test_film_update():
     data = {
@@ -148,6 +293,174 @@ def test_planet_update():
         'films': [1]
     }
 
+# SEARCH TESTS
+@pytest.mark.parametrize('engine', ['columnar', 'sql'])
+def test_planet_search(monkeypatch, engine):
+    monkeypatch.setattr(config, 'PLANET_READ_ENGINE', engine)
+
+    response = client.get('/planet/search', params={
+        'min_population': 1000000,
+        'max_population': 1000000000,
+        'climate': 'Urban',
+        'order_by': 'diameter',
+    })
+    assert response.status_code == 200
+    assert response.json() == [{
+        'id': 1,
+        'name': 'Planeteste',
+        'climates': 'arrid, urban',
+        'diameter': 1000.0,
+        'population': 10000000,
+        'films': [1]
+    }]
+
+@pytest.mark.parametrize('engine', ['columnar', 'sql'])
+def test_planet_search_no_results(monkeypatch, engine):
+    monkeypatch.setattr(config, 'PLANET_READ_ENGINE', engine)
+
+    response = client.get('/planet/search', params={'min_diameter': 2000})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get('/planet/search', params={'climate': 'arr'})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    # Limites fora da faixa de 64 bits do SQLite
+    response = client.get('/planet/search', params={'min_population': 10 ** 20})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get('/planet/search', params={'max_population': -10 ** 20})
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_planet_search_loads_films_up_front(memory_db, monkeypatch):
+    monkeypatch.setattr(config, 'PLANET_READ_ENGINE', 'sql')
+
+    film = models.Film(title='Film')
+    planets = [models.Planet(name=f'Planet {i}') for i in range(20)]
+    memory_db.add_all([film] + planets)
+    memory_db.commit()
+    memory_db.add_all([models.Association(film_id=film.id, planet_id=planet.id) for planet in planets])
+    memory_db.commit()
+    memory_db.expire_all()
+
+    statements = list()
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(memory_db.get_bind(), 'before_cursor_execute', count)
+    try:
+        response = search_planets(order_by=PlanetOrder.id, limit=100, db=memory_db)
+    finally:
+        event.remove(memory_db.get_bind(), 'before_cursor_execute', count)
+
+    assert [planet.films for planet in response] == [[film.id]] * 20
+    # Ids, planetas e associações: uma query cada, qualquer que seja o número de planetas
+    assert len(statements) == 3
+
+def test_planet_columns_large_populations(memory_db):
+    pytest.importorskip('numpy')
+
+    populations = [2 ** 53 + 1, 2 ** 53, None, 2 ** 62 + 1, 2 ** 62]
+    memory_db.add_all([models.Planet(name=f'Planet {i}', population=population) for i, population in enumerate(populations)])
+    memory_db.commit()
+
+    columns = PlanetColumns()
+    for filters in (
+        dict(min_population=2 ** 53 + 1),
+        dict(max_population=2 ** 53),
+        dict(min_population=2 ** 62 + 1, max_population=2 ** 63 - 1),
+        dict(order_by='population'),
+        dict(order_by='population', descending=True),
+        dict(order_by='population', descending=True, limit=2),
+    ):
+        assert columns.search(memory_db, **filters) == search_planet_ids_sql(memory_db, **filters)
+
+    assert columns.search(memory_db, order_by='population', descending=True) == [4, 5, 1, 2, 3]
+
+def test_planet_columns_refresh_while_disabled(memory_db, monkeypatch):
+    pytest.importorskip('numpy')
+
+    planet = models.Planet(name='Planet', population=10)
+    memory_db.add(planet)
+    memory_db.commit()
+
+    columns = PlanetColumns()
+    assert columns.search(memory_db, min_population=5) == [planet.id]
+
+    # Escritas feitas enquanto a engine "sql" está ativa continuam atualizando as colunas
+    monkeypatch.setattr(config, 'PLANET_READ_ENGINE', 'sql')
+    planet.population = 1
+    memory_db.commit()
+    columns.refresh(memory_db, planet.id)
+    monkeypatch.setattr(config, 'PLANET_READ_ENGINE', 'columnar')
+
+    assert columns.search(memory_db, min_population=5) == []
+
+    memory_db.delete(planet)
+    memory_db.commit()
+    columns.refresh(memory_db, planet.id)
+    assert columns.search(memory_db) == []
+
+# RELATED TESTS
+def test_planet_related():
+    data = {
+        'name': 'Planeteste 2',
+        'films': [1]
+    }
+
+    response = client.post('/planet/create/', json=data)
+    assert response.status_code == 201
+
+    response = client.get('/planet/1/related')
+    assert response.status_code == 200
+    assert response.json() == [{'id': 2, 'shared_films': 1}]
+
+def test_planet_related_not_found():
+    response = client.get('/planet/0/related')
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Planet with id 0 not found'}
+
+def test_film_related():
+    response = client.get('/film/1/related')
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_related_index_rereads_committed_links(memory_db):
+    films = [models.Film(title=f'Film {i}') for i in range(2)]
+    planets = [models.Planet(name=f'Planet {i}') for i in range(2)]
+    memory_db.add_all(films + planets)
+    memory_db.commit()
+
+    index = RelatedIndex()
+    assert index.related_planets(memory_db, planets[0].id, 10) == []
+
+    # Duas escritas commitadas em sequência cujos refresh chegam fora de ordem
+    memory_db.add(models.Association(film_id=films[0].id, planet_id=planets[0].id))
+    memory_db.add(models.Association(film_id=films[0].id, planet_id=planets[1].id))
+    memory_db.commit()
+    memory_db.add(models.Association(film_id=films[1].id, planet_id=planets[1].id))
+    memory_db.commit()
+    index.refresh_planet(memory_db, planets[1].id)
+    index.refresh_planet(memory_db, planets[0].id)
+
+    assert index.related_planets(memory_db, planets[0].id, 10) == [(planets[1].id, 1)]
+    assert index.related_films(memory_db, films[0].id, 10) == [(films[1].id, 1)]
+
+def test_ranking_cache_bounded_by_items():
+    cache = RankingCache(max_size=10, max_items=5)
+    cache.put(1, (array('q', [2, 3, 4]), array('q', [3, 2, 1])))
+    cache.put(2, (array('q', [1, 3]), array('q', [2, 2])))
+    assert cache.get(1) is not None
+
+    # Passar do total de pares descarta o ranking usado há mais tempo
+    cache.put(3, (array('q', [1]), array('q', [1])))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert len(cache) == 2 and cache.items == 4
+
 # DELETE TESTS
 def test_film_delete():
     response = client.delete(f'/film/1/delete')
@@ -157,3 +470,187 @@ def test_planet_delete():
     response = client.delete(f'/planet/1/delete')
     assert response.status_code == 204
 
+def test_planet_related_after_delete():
+    response = client.get('/planet/2/related')
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+# ADMISSION TESTS
+def test_metrics():
+    response = client.get('/admin/metrics/')
+    assert response.status_code == 200
+    metrics = response.json()
+    assert set(metrics['groups']) == {'read', 'write'}
+    assert metrics['groups']['read']['admitted'] > 0
+    assert metrics['groups']['write']['admitted'] > 0
+
+def test_rate_limit(monkeypatch):
+    monkeypatch.setattr(admission, 'rate_limiter', admission.RateLimiter(rate=0.5, burst=1, max_clients=10))
+
+    response = client.get('/planet/')
+    assert response.status_code == 200
+
+    response = client.get('/planet/')
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '2'
+    assert client.get('/admin/metrics/').json()['rate_limit']['limited'] == 1
+
+def test_shed_when_queue_is_full(monkeypatch):
+    monkeypatch.setitem(admission.bulkheads, 'read', admission.Bulkhead(limit=0, queue_size=0, timeout=1))
+
+    response = client.get('/planet/')
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == str(config.RETRY_AFTER)
+    assert client.get('/admin/metrics/').json()['groups']['read']['shed'] == 1
+
+def test_bulkhead_queue():
+    async def run():
+        bulkhead = admission.Bulkhead(limit=1, queue_size=1, timeout=1)
+        assert await bulkhead.acquire()
+
+        queued = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        assert bulkhead.queued == 1
+        assert not await bulkhead.acquire()
+
+        bulkhead.release()
+        assert await queued
+        assert bulkhead.metrics() == {
+            'limit': 1, 'queue_size': 1, 'active': 1, 'queued': 0, 'admitted': 2, 'shed': 1,
+        }
+
+    asyncio.run(run())
+
+def test_coalesce_identical_reads():
+    calls = list()
+    received = list()
+
+    async def call(send):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        await send({'type': 'http.response.body', 'body': b'planets'})
+
+    async def send(message):
+        received.append(message)
+
+    async def run():
+        single_flight = admission.SingleFlight()
+        await asyncio.gather(*[single_flight.run(('/planet/', b''), call, send) for _ in range(3)])
+        assert single_flight.coalesced == 2
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert received == [{'type': 'http.response.body', 'body': b'planets'}] * 3
+
+def test_coalesced_reads_keep_cors_headers():
+    calls = list()
+
+    async def endpoint(scope, receive, send):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': b'[]'})
+
+    # Mesma ordem do main.py: CORS por fora do controle de admissão
+    cors_app = CORSMiddleware(
+        admission.AdmissionMiddleware(endpoint),
+        allow_origins=['https://a.example', 'https://b.example'],
+        allow_credentials=True,
+    )
+
+    async def request(headers):
+        messages = list()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/planet/',
+            'query_string': b'',
+            'headers': headers,
+            'client': ('testclient', 50000),
+        }
+        await cors_app(scope, receive, send)
+        return messages
+
+    async def run():
+        return await asyncio.gather(
+            request([(b'origin', b'https://a.example')]),
+            request([(b'origin', b'https://b.example')]),
+            request([(b'origin', b'https://a.example'), (b'cookie', b'session=1')]),
+            request([(b'origin', b'https://b.example'), (b'x-profile', b'token')]),
+        )
+
+    coalesced = admission.single_flight.coalesced
+    # Headers lidos só no final, depois de todas as respostas terem passado pelo CORS
+    responses = [(dict(messages[0]['headers']), messages[1]['body']) for messages in asyncio.run(run())]
+
+    # Só as requisições sem credenciais nem profiling compartilham a resposta
+    assert len(calls) == 3
+    assert admission.single_flight.coalesced == coalesced + 1
+    assert [headers[b'access-control-allow-origin'] for headers, _ in responses] == [
+        b'https://a.example',
+        b'https://b.example',
+        b'https://a.example',
+        b'https://b.example',
+    ]
+    assert all(body == b'[]' for _, body in responses)
+
+def test_cors_wraps_admission():
+    middlewares = [middleware.cls for middleware in app.user_middleware]
+    assert middlewares.index(CORSMiddleware) < middlewares.index(admission.AdmissionMiddleware)
+
+def test_options_skips_admission(monkeypatch):
+    monkeypatch.setitem(admission.bulkheads, 'write', admission.Bulkhead(limit=0, queue_size=0, timeout=1))
+
+    response = client.options('/planet/')
+    assert response.status_code != 503
+    assert admission.bulkheads['write'].shed == 0
+
+# SNAPSHOT TESTS
+def test_load_snapshot(memory_db):
+    assert star_wars_api.load_snapshot(memory_db) is True
+    assert memory_db.query(models.Film).filter(models.Film.official == True).count() == 6
+    assert memory_db.query(models.Planet).filter(models.Planet.official == True).count() == 60
+
+    tatooine = memory_db.query(models.Planet).filter_by(name='Tatooine').first()
+    assert sorted(association.film.title for association in tatooine.films) == [
+        'A New Hope',
+        'Attack of the Clones',
+        'Return of the Jedi',
+        'Revenge of the Sith',
+        'The Phantom Menace',
+    ]
+    assert all(association.official for association in tatooine.films)
+
+    # Snapshot já carregado não é recarregado
+    assert star_wars_api.load_snapshot(memory_db) is False
+
+def test_snapshot_round_trip(memory_db, tmp_path):
+    # Resultados da swapi gravados, os mesmos usados para gerar o snapshot embutido
+    with open(os.path.join(os.path.dirname(__file__), 'data', 'swapi.json'), encoding='utf-8') as file:
+        data = json.load(file)
+
+    snapshot = star_wars_api.build_snapshot(data)
+    bundled, bundled_checksum = star_wars_api.read_snapshot()
+    assert snapshot == bundled
+
+    path = tmp_path / 'official.json.gz'
+    star_wars_api.write_snapshot(snapshot, path)
+    written, checksum = star_wars_api.read_snapshot(path)
+    assert written == bundled
+    assert checksum == bundled_checksum
+
+    assert star_wars_api.load_snapshot(memory_db, path) is True
+    assert memory_db.query(models.Film).count() == len(bundled['films'])
+    assert memory_db.query(models.Planet).count() == len(bundled['planets'])
+    assert memory_db.query(models.Association).count() == sum(len(planet['films']) for planet in bundled['planets'])
+
+    # O snapshot embutido tem o mesmo checksum, então não é recarregado
+    assert star_wars_api.load_snapshot(memory_db) is False